@@ -1,8 +1,7 @@
-import random
+import numpy as np
 import networkx as nx
 from dataclasses import dataclass
-from collections import defaultdict
-from src.topology import path_leaf_to_victim
+from src.topology import VICTIM, get_path
 
 '''
 Edge Sampling:
@@ -29,7 +28,7 @@ Victim reconstruction idea:
 - Chain edges together (or build a graph) to infer attacker location(s)
 '''
 
-@dataclass
+@dataclass(slots=True)
 class EdgePacket:
     # Header fields used by edge sampling
     start: int | None = None # Router that last started a mark
@@ -37,62 +36,107 @@ class EdgePacket:
     distance: int = 0 # Hops since last mark started
 
 class EdgeSampler:
-    def __init__(self, p: float, seed: int = 0):
+    def __init__(self, p: float, seed: int | np.random.SeedSequence = 0):
         self.p = p
-        self.rng = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, seed: int | np.random.SeedSequence) -> None:
+        # Reseed in place so one sampler can be reused across trials
+        self.rng = np.random.default_rng(seed)
 
     def forward(self, G: nx.DiGraph, source_leaf: int) -> EdgePacket:
         # Simulate one packet from source_leaf to victim
         # Routers either:
         # - Start a new mark (set start, reset distance)
         # - Or finish the edge (set end when distance==0) and increase distance
-        pkt = EdgePacket()
-        for router in path_leaf_to_victim(G, source_leaf):
-            if self.rng.random() < self.p:
-                pkt.start = router
-                pkt.distance = 0
+        # All of the path's coin flips are drawn in one call up front
+        # Header fields live in locals during the walk and are packed into the packet at the end
+        start, end, distance = None, None, 0
+        path, p = get_path(G, source_leaf), self.p
+        for router, u in zip(path, self.rng.random(len(path)).tolist()):
+            if u < p:
+                start = router
+                distance = 0
             else:
-                if pkt.distance == 0:
-                    pkt.end = router
-                pkt.distance += 1
-        return pkt
+                if distance == 0:
+                    end = router
+                distance += 1
+        return EdgePacket(start, end, distance)
+
+    def forward_batch(self, path: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Simulate n packets along the same path in one shot
+        # Unmarked packets get start = end = -1 (stands in for None)
+        return _mark_edges(path, self.rng.random((n, len(path))), self.p)
+
+def _mark_edges(path: np.ndarray, u: np.ndarray, p: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Pure marking kernel: u[i, j] is the coin flip of router path[j] for packet i
+    # Only the last router that marked matters:
+    # - start    = that router
+    # - end      = the next router on the path (victim if it was the last hop)
+    # - distance = hops left to the victim after it
+    L = len(path)
+    marks = u < p
+    any_mark = marks.any(axis=1)
+    last = L - 1 - marks[:, ::-1].argmax(axis=1)
+    start, end, distance = edges_at(path, last)
+    start = np.where(any_mark, start, -1)
+    end = np.where(any_mark, end, -1)
+    distance = np.where(any_mark, distance, L).astype(path.dtype) # Never exceeds the node count
+    return start, end, distance
 
-def edges_by_distance(samples, victim=0):
-    # Convert raw samples into edges grouped by distance from victim
+def edges_at(path: np.ndarray, last: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # (start, end, distance) of the edge left by a packet whose last mark was at path[last]
+    nxt = np.empty_like(path)
+    nxt[:-1], nxt[-1] = path[1:], VICTIM
+    return path[last], nxt[last], (len(path) - 1 - last).astype(path.dtype)
+
+def edges_by_distance(samples, victim=0, by_d=None):
+    # Convert raw samples into edges grouped by distance from victim,
+    # then by end router: by_d[d][end] = {starts}
     # distance == 0  -> edge is (start, victim)
     # distance  > 0  -> edge is (start, end) (end must exist)
-    by_d = defaultdict(set)
-
+    # Indexing by end lets reconstruction look up the next hop instead of scanning
+    # Passing an existing by_d adds the new samples to it in place,
+    # so the victim doesn't have to regroup every sample it has seen
+    if by_d is None:
+        by_d = {}
     for s, e, d in samples:
         if s is None:
             continue
         if d == 0:
-            by_d[0].add((s, victim))
-        else:
-            if e is None:
-                continue
-            by_d[d].add((s, e))
-    return dict(by_d)
+            e = victim
+        elif e is None:
+            continue
+        by_d.setdefault(d, {}).setdefault(e, set()).add(s)
+    return by_d
+
+def _edges_of(by_d):
+    # Flatten a by_d index back into (start, end) edges
+    for ends in by_d.values():
+        for e, starts in ends.items():
+            for s in starts:
+                yield s, e
 
 def edge_reconstruct_path(by_d, victim=0) -> list[int]:
     # Reconstruct ONE path by chaining distance-indexed edges
     # Start at distance 0 (router directly connected to victim)
     # Then walk outward by matching (start, end) where end == current node
     # Returned list is [farthest (attacker side), ..., closest to victim]
-    if 0 not in by_d or not by_d[0]:
+    firsts = by_d.get(0, {}).get(victim)
+    if not firsts:
         return []
 
     # Pick a starting neighbor of victim (if multiple exist, choose smallest ID)
-    cur = sorted(by_d[0])[0][0]
+    cur = min(firsts)
     path = [cur]
     d = 1
 
     while d in by_d:
         # Find the router at distance d that points into the current router
-        candidates = [s for (s, e) in by_d[d] if e == cur]
+        candidates = by_d[d].get(cur)
         if not candidates:
             break
-        cur = sorted(candidates)[0]
+        cur = min(candidates)
         path.append(cur)
         d += 1
 
@@ -105,14 +149,38 @@ def edge_build_graph(samples, victim=0) -> nx.DiGraph:
     # In this graph, attackers appear as source nodes (in_degree == 0)
     H = nx.DiGraph()
     H.add_node(victim)
+    return edge_add_samples(H, samples, victim=victim)
 
-    by_d = edges_by_distance(samples, victim=victim)
-    for edges in by_d.values():
-        H.add_edges_from(edges)
+def edge_add_samples(H, samples, victim=0) -> nx.DiGraph:
+    # Add the edges from new samples to an existing reconstruction graph
+    # Lets the victim grow H as packets arrive instead of rebuilding it from all samples
+    H.add_edges_from(_edges_of(edges_by_distance(samples, victim=victim)))
     return H
 
 def edge_guess_attackers_from_graph(H, victim=0) -> list[int]:
     # Attackers are sources in the reconstructed graph:
     # - Victim is excluded
     # - Attacker candidates have in_degree == 0
-    return sorted(n for n in H.nodes if n != victim and H.in_degree(n) == 0)
\ No newline at end of file
+    # One pass over the edges finds every node with an incoming edge
+    has_incoming = {v for _, v in H.edges}
+    return sorted(n for n in H.nodes if n != victim and n not in has_incoming)
+
+def edge_add_to_masks(sources_mask: int, targets_mask: int, samples, victim=0) -> tuple[int, int]:
+    # Bitset form of the reconstruction graph, enough for finding attackers:
+    # - bit n of sources_mask is set once n started an observed edge
+    # - bit n of targets_mask is set once an observed edge points into n
+    for u, v in _edges_of(edges_by_distance(samples, victim=victim)):
+        sources_mask |= 1 << u
+        targets_mask |= 1 << v
+    return sources_mask, targets_mask
+
+def edge_guess_attackers_from_masks(sources_mask: int, targets_mask: int, victim=0) -> list[int]:
+    # Same answer as edge_guess_attackers_from_graph:
+    # sources that nothing points into (in_degree == 0), excluding the victim
+    cand = sources_mask & ~targets_mask & ~(1 << victim)
+    found = []
+    while cand:
+        low = cand & -cand
+        found.append(low.bit_length() - 1)
+        cand ^= low
+    return found
\ No newline at end of file
@@ -1,10 +1,14 @@
-import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import numpy as np
 import networkx as nx
 from dataclasses import dataclass
+from src.topology import get_path, node_dtype, build_topology_caches
 from src.ppm import (
-    choose_hosts, NodeSampler, EdgeSampler,
-    node_reconstruct_order, node_guess_attacker_leaf, node_guess_two_attackers,
-    edges_by_distance, edge_reconstruct_path, edge_build_graph, edge_guess_attackers_from_graph,
+    choose_hosts, CombinedSampler,
+    node_guess_attacker_leaf, node_guess_two_attackers,
+    edges_by_distance, edge_reconstruct_path, edge_add_to_masks, edge_guess_attackers_from_masks,
 )
 
 NORMAL_RATE = 1 # Normal user sends 1 packet per tick
@@ -18,96 +22,165 @@ class Stats:
     node_mean_conv: float | None # Mean ticks to converge (successful trials only)
     edge_mean_conv: float | None
 
-def _run_trial(G, p, x, seed, num_attackers):
+def _q1_checks(G, attacker):
+    # Convergence checks for Q1 (one attacker), returned as (node_ok, edge_ok)
+    by_d = {} # Edges indexed by distance and end router, grown as edges arrive
+
+    def node_ok(node_counts):
+        # Rank routers by frequency, least frequent = farthest = attacker side
+        return node_guess_attacker_leaf(G, None, node_counts) == attacker
+
+    def edge_ok(fresh):
+        # Chain distance-indexed edges from victim outward so path[0] = attacker side
+        edges_by_distance(fresh, victim=0, by_d=by_d)
+        path = edge_reconstruct_path(by_d, victim=0)
+        return bool(path) and path[0] == attacker
+
+    return node_ok, edge_ok
+
+def _q2_checks(G, attackers):
+    # Convergence checks for Q2 (two attackers), returned as (node_ok, edge_ok)
+    # Exact match required where there's no missing attackers & no false positives
+    # Both guess lists are duplicate-free, so comparing sorted lists is the same as
+    # comparing sets without building one every tick
+    true_sorted = sorted(attackers)
+    src_mask = dst_mask = 0 # Reconstruction graph as bitsets, grown as edges arrive
+
+    def node_ok(node_counts):
+        # Group by branch so reconstruct farthest leaf per branch
+        return sorted(node_guess_two_attackers(G, node_counts, 2)) == true_sorted
+
+    def edge_ok(fresh):
+        # Add the new edges to the graph and find source nodes (in_degree==0) as attackers
+        nonlocal src_mask, dst_mask
+        src_mask, dst_mask = edge_add_to_masks(src_mask, dst_mask, fresh, victim=0)
+        return edge_guess_attackers_from_masks(src_mask, dst_mask) == true_sorted # Already ascending
+
+    return node_ok, edge_ok
+
+def _run_trial(G, p, x, seed, num_attackers, sampler=None):
     # Run one simulation trial for either Q1 (num_attackers=1) or Q2 (num_attackers=2)
-    rng = random.Random(seed)
+    # A sampler from a previous trial can be passed in and is reseeded instead of rebuilt
+    # seed is an int or a SeedSequence; host choice and marking get independent child streams
+    ss = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    host_ss, mark_ss = ss.spawn(2)
 
     # Select attacker and normal user leaves (one attacker per branch, one normal user)
-    hosts     = choose_hosts(G, num_attackers=num_attackers, num_normal=1, seed=seed + 1)
+    hosts     = choose_hosts(G, num_attackers=num_attackers, num_normal=1, seed=int(host_ss.generate_state(1)[0]))
     attackers = hosts.attackers
-    normal    = hosts.normal_users
 
-    # Independent samplers per trial to avoid RNG state sharing between trials
-    NS = NodeSampler(p=p, seed=rng.randint(0, 10**9))
-    ES = EdgeSampler(p=p, seed=rng.randint(0, 10**9))
+    # Fresh RNG stream per trial to avoid RNG state sharing between trials
+    # Node and edge marking run together so each packet's path is walked once
+    CS = sampler or CombinedSampler(p_node=p, p_edge=p)
+    CS.p_node = CS.p_edge = p
+    CS.reset(mark_ss)
 
-    node_obs, edge_obs = [], [] # Observations collected at the victim
+    node_counts = Counter() # Marks per router ID, updated as packets arrive
     node_conv = edge_conv = None # Tick at which each algorithm converges (None = not yet)
-    true_set = set(attackers) # Set truth for exact-match checking in Q2
+    edge_seen = set() # Distinct (start, end, distance) samples so far
+
+    # Pick the Q1 or Q2 checks once, so the tick loop itself has no attacker-count branches
+    if num_attackers == 1:
+        node_ok, edge_ok = _q1_checks(G, attackers[0])
+    else:
+        node_ok, edge_ok = _q2_checks(G, attackers)
+
+    # Attacker paths never change during a trial, so build the arrays once
+    # Router IDs are stored in the narrowest dtype so the per-tick batch arrays stay small
+    paths = {a: np.asarray(get_path(G, a), dtype=node_dtype(G)) for a in attackers}
 
     for tick in range(1, MAX_TICKS + 1):
 
-        # Normal user sends background traffic each tick
-        # Marks are not recorded so victim only processes attack packets
-        for b in normal:
-            for _ in range(NORMAL_RATE):
-                NS.forward(G, b)
-                ES.forward(G, b)
+        # The normal user also sends NORMAL_RATE packets per tick, but the victim never
+        # records their marks and the sampler is reseeded at the start of every trial,
+        # so their packets are not simulated
 
         # Each attacker sends x packets per tick (x times faster than normal user)
         # Higher x = more marked samples = easier/faster to reconstruct path
+        # The whole tick's packets are drawn as per-router counts, one multinomial per attacker
+        new_edges = []
         for a in attackers:
-            for _ in range(x * NORMAL_RATE):
-                pN = NS.forward(G, a)
-                if pN.node is not None:
-                    node_obs.append(pN.node) # Record marked router ID
-                pE = ES.forward(G, a)
-                edge_obs.append((pE.start, pE.end, pE.distance)) # Record edge tuple
+            (routers, counts), (s, e, d) = CS.forward_counts(paths[a], x * NORMAL_RATE)
+            node_counts.update(dict(zip(routers.tolist(), counts.tolist()))) # Count marked router IDs
+            new_edges.extend(zip(s.tolist(), e.tolist(), d.tolist())) # Record distinct edge tuples
+
+        # Edge reconstruction only depends on the set of distinct samples,
+        # so the guess can only change on a tick that brought a new one
+        fresh = set(new_edges) - edge_seen
+        edge_seen |= fresh
 
         # Check node sampling convergence once per tick
-        if node_conv is None:
-            if num_attackers == 1:
-                # Rank routers by frequency, least frequent = farthest = attacker side
-                g = node_guess_attacker_leaf(G, node_reconstruct_order(node_obs), node_obs)
-                if g == attackers[0]:
-                    node_conv = tick
-            else:
-                # Q2: group by branch so reconstruct farthest leaf per branch
-                if set(node_guess_two_attackers(G, node_obs, 2)) == true_set:
-                    node_conv = tick
-
-        # Check edge sampling convergence once per tick
-        if edge_conv is None:
-            if num_attackers == 1:
-                # Chain distance-indexed edges from victim outward so path[0] = attacker side
-                path = edge_reconstruct_path(edges_by_distance(edge_obs), victim=0)
-                if path and path[0] == attackers[0]:
-                    edge_conv = tick
-            else:
-                # Q2: build graph and find source nodes (in_degree==0) as attackers
-                # Exact match required where there's no missing attackers & no false positives
-                H = edge_build_graph(edge_obs, victim=0)
-                if set(edge_guess_attackers_from_graph(H)) == true_set:
-                    edge_conv = tick
+        if node_conv is None and node_ok(node_counts):
+            node_conv = tick
+
+        # Check edge sampling convergence on ticks that saw a new edge
+        if edge_conv is None and fresh and edge_ok(fresh):
+            edge_conv = tick
 
         if node_conv and edge_conv:
             break  # Both converged, so there's no need to continue
 
     return (1 if node_conv else 0), (1 if edge_conv else 0), node_conv, edge_conv
 
-def _run_grid(G, p_values, x_values, trials, seed, num_attackers) -> dict:
+# Each worker process keeps its own copy of G so it is pickled once per worker, not per trial
+# It also reuses one sampler for all of its trials
+_WORKER_G = None
+_WORKER_SAMPLER = None
+
+def _init_worker(G):
+    global _WORKER_G, _WORKER_SAMPLER
+    _WORKER_G = G
+    _WORKER_SAMPLER = CombinedSampler(p_node=0.0, p_edge=0.0)
+
+def _trial_worker(job):
+    x, p, seed, num_attackers = job
+    return _run_trial(_WORKER_G, p, x, seed, num_attackers, sampler=_WORKER_SAMPLER)
+
+def run_grid(G, p_values, x_values, trials, num_attackers, seed=0, workers=None) -> dict:
     # Go through all (x, p) combinations, running 'trials'
     # Returns a Stats object per (x, p) pair
-    rng = random.Random(seed)
+    # Trials are independent, so they run in a process pool (workers=None uses every core)
+
+    # Build the cached topology views once here (a no-op if validation already did),
+    # so every trial and every worker's copy of G starts with them already filled in
+    build_topology_caches(G)
+
+    # Spawn one independent seed stream per trial up front, in grid order,
+    # so results don't depend on scheduling
+    grid = [(x, p) for x in x_values for p in p_values for _ in range(trials)]
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    jobs = [(x, p, ss, num_attackers) for (x, p), ss in zip(grid, seeds)]
+    if workers == 1:
+        sampler = CombinedSampler(p_node=0.0, p_edge=0.0)
+        return _aggregate(jobs, trials, (_run_trial(G, p, x, s, na, sampler=sampler) for x, p, s, na in jobs))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(G,)) as ex:
+        return _aggregate(jobs, trials, ex.map(_trial_worker, jobs, chunksize=4))
+
+def _aggregate(jobs, trials, outcomes) -> dict:
+    # Fold trial outcomes (in job order) into one Stats per (x, p) as they arrive
+    # Mean convergence uses Welford's running mean, so no per-trial lists are kept
     results = {}
-    for x in x_values:
-        for p in p_values:
-            ns, es, nc, ec = 0, 0, [], []
-            for _ in range(trials):
-                n_ok, e_ok, n_c, e_c = _run_trial(G, p, x, rng.randint(0, 10**9), num_attackers)
-                ns += n_ok; es += e_ok
-                if n_c: nc.append(n_c)
-                if e_c: ec.append(e_c)
-            results[(x, p)] = Stats(
-                node_acc=ns/trials, edge_acc=es/trials,
-                node_mean_conv=sum(nc)/len(nc) if nc else None,
-                edge_mean_conv=sum(ec)/len(ec) if ec else None,
-            )
+    for i in range(0, len(jobs), trials):
+        x, p = jobs[i][:2]
+        ns = es = 0
+        n_mean = e_mean = 0.0
+        for n_ok, e_ok, n_c, e_c in islice(outcomes, trials):
+            if n_ok:
+                ns += 1
+                n_mean += (n_c - n_mean) / ns
+            if e_ok:
+                es += 1
+                e_mean += (e_c - e_mean) / es
+        results[(x, p)] = Stats(
+            node_acc=ns/trials, edge_acc=es/trials,
+            node_mean_conv=n_mean if ns else None,
+            edge_mean_conv=e_mean if es else None,
+        )
     return results
 
 # Q1 and Q2 are the same runs, just different attacker counts
-def run_grid_one_attacker(G, p_values, x_values, trials, seed=0):
-    return _run_grid(G, p_values, x_values, trials, seed, num_attackers=1)
+def run_grid_one_attacker(G, p_values, x_values, trials, seed=0, workers=None):
+    return run_grid(G, p_values, x_values, trials, num_attackers=1, seed=seed, workers=workers)
 
-def run_grid_two_attackers(G, p_values, x_values, trials, seed=0):
-    return _run_grid(G, p_values, x_values, trials, seed, num_attackers=2)
\ No newline at end of file
+def run_grid_two_attackers(G, p_values, x_values, trials, seed=0, workers=None):
+    return run_grid(G, p_values, x_values, trials, num_attackers=2, seed=seed, workers=workers)
\ No newline at end of file
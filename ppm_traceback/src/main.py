@@ -2,21 +2,52 @@
 # Date: February 17, 2026
 # CS 645 Assignment 1: Probabilistic Packet Marking with Node and Edge Sampling
 
-import matplotlib.pyplot as plt
+import hashlib
+import os
+import pickle
+import tempfile
+import numpy as np
+from matplotlib.figure import Figure # Plain Figures, no pyplot state or GUI backend; savefig renders with Agg
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from src.topology import load_topology, validate_tree_topology
-from src.experiment import run_grid_one_attacker, run_grid_two_attackers
+from src.experiment import run_grid, NORMAL_RATE, MAX_TICKS
 
 # Directory to save all generated plots
 PLOT_DIR = Path("data/plots")
 PLOT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Directory for saved grid results, so re-plotting doesn't rerun the simulation
+CACHE_DIR = Path("data/cache")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+# Hash of the simulation sources (src/*.py), part of every cache key,
+# so editing the code invalidates saved results instead of replotting stale ones
+SRC_HASH = hashlib.sha1(b"".join(f.read_bytes() for f in sorted(Path(__file__).parent.glob("*.py")))).hexdigest()
+
 P_VALUES = [0.2, 0.4, 0.5, 0.6, 0.8] # Marking probabilities to sweep
 X_VALUES = [10, 100, 1000] # Attacker rate multipliers
 
+@dataclass
+class GridArrays:
+    # Grid results as (len(X_VALUES), len(P_VALUES)) arrays: row = x, column = p
+    node_acc: np.ndarray
+    edge_acc: np.ndarray
+    node_conv: np.ndarray # NaN where the algorithm never converged
+    edge_conv: np.ndarray
+
+# Convert the {(x, p): Stats} dict once so the plots slice rows/columns instead of re-indexing it
+def to_matrix(results) -> GridArrays:
+    def grid(field):
+        vals = [[getattr(results[(x, p)], field) for p in P_VALUES] for x in X_VALUES]
+        return np.array(vals, dtype=float) # None becomes NaN
+    return GridArrays(grid("node_acc"), grid("edge_acc"), grid("node_mean_conv"), grid("edge_mean_conv"))
+
 # Helper to create a figure with two subplots (node left, edge right)
 def _side_by_side(title, xlabel, xscale=None):
-    fig, axes = plt.subplots(1, 2, figsize=(12, 5), sharey=True) # sharey=True keeps the y-axis scale the same
+    fig = Figure(figsize=(12, 5))
+    axes = fig.subplots(1, 2, sharey=True) # sharey=True keeps the y-axis scale the same
     for ax, name in zip(axes, ["Node sampling", "Edge sampling"]):
         ax.set_title(name); ax.set_xlabel(xlabel)
         ax.grid(True, linestyle="--", alpha=0.4)
@@ -26,62 +57,81 @@ def _side_by_side(title, xlabel, xscale=None):
     return fig, axes
 
 # Shows how marking probability p affects accuracy
-def plot_accuracy_vs_p(results, prefix):
+def plot_accuracy_vs_p(grid, prefix):
     # Each line is one attacker rate x with both algorithms side by side
     # Optimal p = 1/d; higher p causes downstream
     # Routers to overwrite upstream marks, degrading edge sampling accuracy
     fig, axes = _side_by_side(f"{prefix}: Accuracy vs p", "Marking probability p")
     colors = {10: "tab:blue", 100: "tab:orange", 1000: "tab:green"}
-    for x in X_VALUES:
-        axes[0].plot(P_VALUES, [results[(x,p)].node_acc for p in P_VALUES], "o-", label=f"x={x}", color=colors[x])
-        axes[1].plot(P_VALUES, [results[(x,p)].edge_acc for p in P_VALUES], "s-", label=f"x={x}", color=colors[x])
+    for ix, x in enumerate(X_VALUES):
+        axes[0].plot(P_VALUES, grid.node_acc[ix], "o-", label=f"x={x}", color=colors[x])
+        axes[1].plot(P_VALUES, grid.edge_acc[ix], "s-", label=f"x={x}", color=colors[x])
     for ax in axes: ax.set_ylim(-0.05, 1.05); ax.legend(title="Attacker rate")
-    plt.tight_layout(); plt.savefig(PLOT_DIR / f"{prefix}_accuracy_vs_p.png", dpi=200); plt.close()
+    fig.tight_layout(); fig.savefig(PLOT_DIR / f"{prefix}_accuracy_vs_p.png", dpi=200)
 
 # Shows how attacker rate x affects accuracy
-def plot_accuracy_vs_x(results, prefix):
+def plot_accuracy_vs_x(grid, prefix):
     # Each line is one marking probability p & log scale on x-axis
     # Higher x = more attack packets per tick =
     # Victim accumulates enough samples to reconstruct path within time limit
     fig, axes = _side_by_side(f"{prefix}: Accuracy vs x", "Attacker rate multiplier x (log scale)", xscale="log")
     colors = {0.2:"tab:blue",0.4:"tab:orange",0.5:"tab:green",0.6:"tab:red",0.8:"tab:purple"}
-    for p in P_VALUES:
-        axes[0].plot(X_VALUES, [results[(x,p)].node_acc for x in X_VALUES], "o-", label=f"p={p}", color=colors[p])
-        axes[1].plot(X_VALUES, [results[(x,p)].edge_acc for x in X_VALUES], "s-", label=f"p={p}", color=colors[p])
+    for ip, p in enumerate(P_VALUES):
+        axes[0].plot(X_VALUES, grid.node_acc[:, ip], "o-", label=f"p={p}", color=colors[p])
+        axes[1].plot(X_VALUES, grid.edge_acc[:, ip], "s-", label=f"p={p}", color=colors[p])
     for ax in axes: ax.set_ylim(-0.05, 1.05); ax.legend(title="Marking prob")
-    plt.tight_layout(); plt.savefig(PLOT_DIR / f"{prefix}_accuracy_vs_x.png", dpi=200); plt.close()
+    fig.tight_layout(); fig.savefig(PLOT_DIR / f"{prefix}_accuracy_vs_x.png", dpi=200)
 
 # Shows how quickly each algorithm identifies the attacker (in ticks)
-def plot_convergence(results, prefix):
+def plot_convergence(grid, prefix):
     # Only counts successful trials & NaN shown where algorithm never converged
     # Faster convergence means victim can filter attack traffic sooner
-    fig, axes = plt.subplots(1, 2, figsize=(12, 5), sharey=True)
+    fig = Figure(figsize=(12, 5))
+    axes = fig.subplots(1, 2, sharey=True)
     colors = {10: "tab:blue", 100: "tab:orange", 1000: "tab:green"}
-    for x in X_VALUES:
-        axes[0].plot(P_VALUES, [results[(x,p)].node_mean_conv or float("nan") for p in P_VALUES], "o-", label=f"x={x}", color=colors[x])
-        axes[1].plot(P_VALUES, [results[(x,p)].edge_mean_conv or float("nan") for p in P_VALUES], "s-", label=f"x={x}", color=colors[x])
+    for ix, x in enumerate(X_VALUES):
+        axes[0].plot(P_VALUES, grid.node_conv[ix], "o-", label=f"x={x}", color=colors[x])
+        axes[1].plot(P_VALUES, grid.edge_conv[ix], "s-", label=f"x={x}", color=colors[x])
     for ax, name in zip(axes, ["Node sampling", "Edge sampling"]):
         ax.set_title(name); ax.set_xlabel("Marking probability p")
         ax.grid(True, linestyle="--", alpha=0.4); ax.legend(title="Attacker rate")
     axes[0].set_ylabel("Mean ticks to converge")
     fig.suptitle(f"{prefix}: Convergence speed vs p", fontsize=13)
-    plt.tight_layout(); plt.savefig(PLOT_DIR / f"{prefix}_convergence.png", dpi=200); plt.close()
+    fig.tight_layout(); fig.savefig(PLOT_DIR / f"{prefix}_convergence.png", dpi=200)
 
+# Load grid results from CACHE_DIR if this exact run was done before, otherwise run and save them
+def cached_run_grid(G, topo_path, trials, num_attackers, seed):
+    # Key covers the topology file contents, the simulation code and every setting that changes the results
+    topo_hash = hashlib.sha1(Path(topo_path).read_bytes()).hexdigest()
+    settings = (SRC_HASH, topo_hash, P_VALUES, X_VALUES, trials, num_attackers, seed, NORMAL_RATE, MAX_TICKS)
+    cache_file = CACHE_DIR / f"results_{hashlib.sha1(repr(settings).encode()).hexdigest()}.pkl"
+    if cache_file.exists():
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            pass # Left behind by an interrupted older run, so rebuild it
+    results = run_grid(G, P_VALUES, X_VALUES, trials=trials, num_attackers=num_attackers, seed=seed)
+    # Write to a temp file and rename it into place, so an interrupted run never leaves a partial cache file
+    with tempfile.NamedTemporaryFile("wb", dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+        pickle.dump(results, f)
+    os.replace(f.name, cache_file)
+    return results
 
 def main():
+    plots = [] # (plot function, grid, prefix) for every figure, rendered together at the end
     for path, label in [("data/topology1.txt", "topo1"), ("data/topology2.txt", "topo2")]:
         print(f"\nTopology: {path}")
         G = load_topology(path)
         validate_tree_topology(G)
 
         # Run Q1 and Q2 for this topology and save all plots
-        for q, run, na in [("Q1", run_grid_one_attacker, 1), ("Q2", run_grid_two_attackers, 2)]:
+        for q, na in [("Q1", 1), ("Q2", 2)]:
             print(f"Running {q} ({na} attacker{'s' if na > 1 else ''}, 1 normal user)...")
-            results = run(G, P_VALUES, X_VALUES, trials=50, seed=123 if q == "Q1" else 456)
+            results = cached_run_grid(G, path, trials=50, num_attackers=na, seed=123 if q == "Q1" else 456)
             prefix = f"{q}_{label}"
-            plot_accuracy_vs_p(results, prefix)
-            plot_accuracy_vs_x(results, prefix)
-            plot_convergence(results, prefix)
+            grid = to_matrix(results)
+            plots += [(fn, grid, prefix) for fn in (plot_accuracy_vs_p, plot_accuracy_vs_x, plot_convergence)]
 
             # Print summary table for checking
             print(f"\n{q} accuracy summary ({label})")
@@ -93,6 +143,11 @@ def main():
                     ec = f"{s.edge_mean_conv:.1f}" if s.edge_mean_conv else "N/A"
                     print(f"{x:>6}  {p:>5.2f}  {s.node_acc:>10.3f}  {s.edge_acc:>10.3f}  {nc:>10}  {ec:>10}")
 
+    # Figures are independent and savefig at dpi=200 is the slow part, so render them in parallel
+    with ProcessPoolExecutor() as ex:
+        for fut in [ex.submit(fn, grid, prefix) for fn, grid, prefix in plots]:
+            fut.result() # Re-raise any plotting error here
+
     print(f"\nDone! Plots saved to {PLOT_DIR}")
 
 if __name__ == "__main__":
@@ -1,8 +1,9 @@
-import random
+import numpy as np
 import networkx as nx
 from dataclasses import dataclass
 from collections import Counter
-from src.topology import branch_root_of, path_leaf_to_victim
+from operator import itemgetter
+from src.topology import get_path, subtree_leaves, topology_to_arrays
 
 '''
 Node Sampling:
@@ -20,60 +21,87 @@ Reconstruction idea:
 - Sorting by frequency gives an ordering from victim side -> attacker side
 '''
 
-@dataclass
+@dataclass(slots=True)
 class NodePacket:
     # One header field: last router that marked the packet
     # None means the packet was never marked
     node: int | None = None
 
 class NodeSampler:
-    def __init__(self, p: float, seed: int = 0):
+    def __init__(self, p: float, seed: int | np.random.SeedSequence = 0):
         self.p = p
-        self.rng = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, seed: int | np.random.SeedSequence) -> None:
+        # Reseed in place so one sampler can be reused across trials
+        self.rng = np.random.default_rng(seed)
 
     def forward(self, G: nx.DiGraph, source_leaf: int) -> NodePacket:
         # Simulate one packet from source_leaf to victim
         # Each router overwrites pkt.node with probability p (last write wins)
+        # All of the path's coin flips are drawn in one call up front
+        # p and the draws are bound to locals so the loop does no attribute lookups
         pkt = NodePacket()
-        for router in path_leaf_to_victim(G, source_leaf):
-            if self.rng.random() < self.p:
+        path, p = get_path(G, source_leaf), self.p
+        for router, u in zip(path, self.rng.random(len(path)).tolist()):
+            if u < p:
                 pkt.node = router
         return pkt
 
-def node_reconstruct_order(node_obs: list[int]) -> list[int]:
+    def forward_batch(self, path: np.ndarray, n: int) -> np.ndarray:
+        # Simulate n packets along the same path in one shot
+        # Returns only the marked routers (unmarked packets carry no info)
+        return _mark_nodes(path, self.rng.random((n, len(path))), self.p)
+
+def _mark_nodes(path: np.ndarray, u: np.ndarray, p: float) -> np.ndarray:
+    # Pure marking kernel: u[i, j] is the coin flip of router path[j] for packet i
+    # Last write wins, so the surviving mark is the last True in each row
+    L = len(path)
+    marks = u < p
+    any_mark = marks.any(axis=1)
+    last = L - 1 - marks[:, ::-1].argmax(axis=1)
+    return path[last[any_mark]]
+
+def _count_marks(node_obs: list[int] | Counter) -> Counter:
+    # Counter of marks in first-seen order, which is the order ties break on
+    # A Counter the caller keeps up to date is used as-is
+    return node_obs if isinstance(node_obs, Counter) else Counter(node_obs)
+
+def node_reconstruct_order(node_obs: list[int] | Counter) -> list[int]:
     # Victim reconstruction (slides):
     # - Count marks per router ID
     # - Sort by count (high -> low)
     # - High count = close to victim, low count = farther (attacker side)
-    return [n for n, _ in Counter(node_obs).most_common()]
+    # Also accepts a Counter the caller keeps up to date, so marks aren't recounted
+    return [n for n, _ in _count_marks(node_obs).most_common()]
+
+def node_least_frequent(node_obs: list[int] | Counter) -> int | None:
+    # Same as node_reconstruct_order(node_obs)[-1] without sorting every router:
+    # lowest count, ties going to the router seen last
+    counts = _count_marks(node_obs)
+    if not counts:
+        return None
+    return min(reversed(counts.items()), key=itemgetter(1))[0]
 
 def node_guess_attacker_leaf(G, ordered_nodes, node_obs=None) -> int | None:
     # Guess attacker as:
     # 1) farthest observed router = least frequent router
     # 2) attacker must be in that router's subtree
     # 3) return a leaf in that subtree (prefer a leaf seen in node_obs if possible)
-    if not ordered_nodes:
+    # Pass ordered_nodes=None to take the farthest router straight from node_obs
+    if ordered_nodes is None:
+        farthest = node_least_frequent(node_obs) if node_obs is not None else None
+    else:
+        farthest = ordered_nodes[-1] if ordered_nodes else None
+    if farthest is None:
         return None
 
-    farthest = ordered_nodes[-1]
-
-    # Collect all leaves in farthest's subtree
-    stack = [farthest]
-    leafs = []
-    while stack:
-        u = stack.pop()
-        kids = list(G.successors(u))
-        if not kids:
-            leafs.append(u)
-        else:
-            stack.extend(kids)
-
-    if not leafs:
-        return farthest
+    # Leaves in farthest's subtree (precomputed once per topology)
+    leafs = subtree_leaves(G, farthest)
 
     # If any leaf itself appeared as a mark, prefer it (strong signal)
     if node_obs:
-        obs = set(node_obs)
+        obs = node_obs if isinstance(node_obs, Counter) else set(node_obs)
         seen = [lf for lf in leafs if lf in obs]
         if seen:
             return seen[0]
@@ -85,13 +113,17 @@ def node_guess_two_attackers(G, node_obs, max_attackers=2) -> list[int]:
     # - Group marks by branch (child of victim)
     # - Run single-attacker guess per branch
     # - Pick top branches with the most observations
-    by_branch: dict[int, list[int]] = {}
-    for n in node_obs:
-        by_branch.setdefault(branch_root_of(G, n), []).append(n)
+    # node_obs may be a list of marks or a Counter of them
+    counts = _count_marks(node_obs)
+    # Branch of every router is precomputed; fetch the array once instead of per mark
+    branch = topology_to_arrays(G).branch.tolist()
+    by_branch: dict[int, Counter] = {}
+    for n, c in counts.items():
+        by_branch.setdefault(branch[n], Counter())[n] = c
 
     guesses = []
-    for _, obs in sorted(by_branch.items(), key=lambda kv: len(kv[1]), reverse=True):
-        g = node_guess_attacker_leaf(G, node_reconstruct_order(obs), node_obs=obs)
+    for _, obs in sorted(by_branch.items(), key=lambda kv: kv[1].total(), reverse=True):
+        g = node_guess_attacker_leaf(G, None, node_obs=obs)
         if g and g not in guesses:
             guesses.append(g)
         if len(guesses) >= max_attackers:
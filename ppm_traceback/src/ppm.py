@@ -1,7 +1,9 @@
 import random
+from functools import lru_cache
+import numpy as np
 import networkx as nx
 from dataclasses import dataclass
-from src.topology import leaves, branch_root_of
+from src.topology import leaves, leaves_by_branch
 
 # Re-export both algorithm modules so experiment.py can import everything
 # From src.ppm without needing to know about the individual files
@@ -21,10 +23,9 @@ def choose_hosts(G, num_attackers, num_normal=1, seed=0) -> Hosts:
     rng = random.Random(seed)
 
     # Group all leaves by their branch so we can enforce one attacker per branch
+    # (grouping is cached per topology, only the random picks happen per call)
     leafs = leaves(G)
-    by_branch: dict[int, list[int]] = {}
-    for lf in leafs:
-        by_branch.setdefault(branch_root_of(G, lf), []).append(lf)
+    by_branch = leaves_by_branch(G)
 
     # Shuffle branch order so attacker placement varies across trials
     branch_keys = list(by_branch.keys())
@@ -36,6 +37,45 @@ def choose_hosts(G, num_attackers, num_normal=1, seed=0) -> Hosts:
         raise ValueError("Not enough branches for requested attackers")
 
     # Normal users are drawn from leaves not already chosen as attackers
-    remaining = [lf for lf in leafs if lf not in attackers]
+    attacker_set = set(attackers)
+    remaining = [lf for lf in leafs if lf not in attacker_set]
     rng.shuffle(remaining)
-    return Hosts(attackers=attackers, normal_users=remaining[:num_normal])
\ No newline at end of file
+    return Hosts(attackers=attackers, normal_users=remaining[:num_normal])
+
+class CombinedSampler:
+    # Runs node and edge sampling over the same packets in a single pass
+    # Each scheme still flips its own coins, so neither sees the other's marks
+    def __init__(self, p_node: float, p_edge: float, seed: int | np.random.SeedSequence = 0):
+        self.p_node = p_node
+        self.p_edge = p_edge
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self, seed: int | np.random.SeedSequence) -> None:
+        # Reseed in place so one sampler can be reused across trials
+        self.rng = np.random.default_rng(seed)
+
+    def forward_counts(self, path: np.ndarray, n: int) -> tuple[tuple[np.ndarray, np.ndarray], tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # Same distribution as running NodeSampler and EdgeSampler.forward_batch on n packets,
+        # without simulating packets one by one
+        # The surviving mark only depends on which router marked last, a categorical over
+        # the path, so one multinomial draw per scheme gives the whole batch's counts
+        # Returns ((marked routers, counts), distinct (start, end, distance) edges)
+        L = len(path)
+        node_n = self.rng.multinomial(n, _last_mark_probs(L, self.p_node))[:-1]
+        edge_n = self.rng.multinomial(n, _last_mark_probs(L, self.p_edge))[:-1]
+        # Order routers as they would first show up in the packet stream: in a random
+        # arrangement each next new router is picked in proportion to its count
+        hit = np.flatnonzero(node_n)
+        hit = hit[np.argsort(self.rng.exponential(size=len(hit)) / node_n[hit])]
+        return (path[hit], node_n[hit]), edges_at(path, np.flatnonzero(edge_n))
+
+@lru_cache(maxsize=None)
+def _last_mark_probs(L: int, p: float) -> np.ndarray:
+    # P(last mark at path[i]) = p * (1-p)^(L-1-i): router i marks and nobody after it does
+    # The final entry is P(never marked) = (1-p)^L
+    # Only a few (path length, p) pairs exist per grid, so each vector is built once
+    # and shared read-only instead of being recomputed every tick
+    q = 1.0 - p
+    probs = np.append(p * q ** np.arange(L - 1, -1, -1), q ** L)
+    probs.flags.writeable = False
+    return probs
@@ -1,24 +1,26 @@
+import numpy as np
+from itertools import chain
 import networkx as nx
+from dataclasses import dataclass
 
 VICTIM = 0  # Node 0 is always the victim, which is root of the tree
 
 def load_topology(path: str) -> nx.DiGraph:
     # Read topology file and build a directed graph
     # Each line is "u v" meaning router u forwards packets toward router v
+    # loadtxt tokenizes in C and skips blank lines and "#" comments; edges keep file order
+    edges = np.loadtxt(path, dtype=np.int64, comments="#", ndmin=2, encoding="utf-8")
     G = nx.DiGraph()
-    with open(path, encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            u, v = map(int, line.split())
-            G.add_edge(u, v)
+    G.add_edges_from(edges.tolist())
     return G
 
 def validate_tree_topology(G: nx.DiGraph) -> None:
     # Must follow all constraints before running experiments
     if VICTIM not in G.nodes:
         raise ValueError("Victim node 0 must exist")
+    # Node IDs index the cached arrays directly, so a negative ID would silently wrap around
+    if min(G.nodes) < 0:
+        raise ValueError("Node IDs must be non-negative")
     # Must be a directed tree: no cycles, one parent per node, fully connected
     if not nx.is_arborescence(G):
         raise ValueError("Topology must be a directed tree")
@@ -33,24 +35,107 @@ def validate_tree_topology(G: nx.DiGraph) -> None:
     depths = nx.single_source_shortest_path_length(G, VICTIM)
     if max(depths.values()) > 15:
         raise ValueError("Max depth must be <= 15")
+    # The topology is fixed from here on, so build its cached views now
+    build_topology_caches(G)
+
+def build_topology_caches(G: nx.DiGraph) -> None:
+    # Fill every cached view of the tree stored on G.graph (arrays, leaf grouping,
+    # subtree leaves, leaf paths), so later lookups and pickled copies of G never rebuild them
+    topology_to_arrays(G)
+    leaves_by_branch(G)
+    subtree_leaves(G, VICTIM)
+    for lf in leaves(G):
+        get_path(G, lf)
 
 def leaves(G: nx.DiGraph) -> list[int]:
     # Leaf nodes are routers with no successors or where endpoints that hosts connect at
-    return [n for n in G.nodes if n != VICTIM and G.out_degree(n) == 0]
+    # The scan is done once per topology and cached on the graph
+    cached = G.graph.get("leaves")
+    if cached is None:
+        cached = G.graph["leaves"] = tuple(n for n in G.nodes if n != VICTIM and G.out_degree(n) == 0)
+    return list(cached)
+
+def leaves_by_branch(G: nx.DiGraph) -> dict[int, tuple[int, ...]]:
+    # Leaves grouped by branch root (direct child of the victim), in leaves() order
+    # Computed once per topology and cached on the graph; callers must not mutate it
+    cached = G.graph.get("leaves_by_branch")
+    if cached is None:
+        groups: dict[int, list[int]] = {}
+        for lf in leaves(G):
+            groups.setdefault(branch_root_of(G, lf), []).append(lf)
+        cached = G.graph["leaves_by_branch"] = {br: tuple(lfs) for br, lfs in groups.items()}
+    return cached
+
+def subtree_leaves(G: nx.DiGraph, node: int) -> tuple[int, ...]:
+    # Leaves under node (node itself if it is a leaf), built for every node in one postorder pass
+    # Last child's leaves come first, matching the order of the old stack-based DFS
+    cached = G.graph.get("subtree_leaves")
+    if cached is None:
+        cached = {}
+        for u in reversed(list(nx.topological_sort(G))):
+            kids = list(G.successors(u))
+            cached[u] = (u,) if not kids else tuple(chain.from_iterable(cached[c] for c in reversed(kids)))
+        G.graph["subtree_leaves"] = cached
+    return cached[node]
+
+@dataclass(frozen=True)
+class TopoArrays:
+    # Struct-of-arrays view of the tree, every array indexed by node ID
+    parent: np.ndarray  # Next router toward the victim (-1 for the victim)
+    branch: np.ndarray  # Direct child of the victim that n hangs under (-1 for the victim)
+
+def topology_to_arrays(G: nx.DiGraph) -> TopoArrays:
+    # Flatten the tree once so hot-path queries are array lookups instead of NetworkX calls
+    # Cached on the graph itself since the topology never changes after loading
+    arrays = G.graph.get("arrays")
+    if arrays is not None:
+        return arrays
+
+    # Every entry is a node ID or -1, so both arrays use the narrow node dtype
+    V = max(G.nodes) + 1
+    dt = node_dtype(G)
+    parent = np.full(V, -1, dtype=dt)
+    branch = np.full(V, -1, dtype=dt)
+    for u, v in G.edges:
+        parent[v] = u
+    # Parents come before children in topological order, so one pass fills branch
+    for n in nx.topological_sort(G):
+        if parent[n] >= 0:
+            branch[n] = n if parent[n] == VICTIM else branch[parent[n]]
+
+    arrays = G.graph["arrays"] = TopoArrays(parent, branch)
+    return arrays
+
+def node_dtype(G: nx.DiGraph) -> type:
+    # Smallest signed int type that holds every node ID plus the -1 "no node" sentinel
+    # Topologies here have at most ~20 routers, so per-packet arrays fit in int8
+    top = max(G.nodes)
+    if top <= np.iinfo(np.int8).max:
+        return np.int8
+    if top <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
 
 def branch_root_of(G: nx.DiGraph, node: int) -> int:
-    # Go through the tree until it reaches a direct child of the victim
-    # This identifies which branch a given node belongs to
-    cur = node
-    while list(G.predecessors(cur))[0] != VICTIM:
-        cur = list(G.predecessors(cur))[0]
-    return cur
+    # The direct child of the victim whose subtree contains node
+    # This identifies which branch a given node belongs to (precomputed in topology_to_arrays)
+    return int(topology_to_arrays(G).branch[node])
 
 def path_leaf_to_victim(G: nx.DiGraph, leaf: int) -> list[int]:
     # Return ordered list of routers from source leaf toward the victim
     # Used to simulate a packet travelling through the network
+    parent = topology_to_arrays(G).parent
     path, cur = [], leaf
     while cur != VICTIM:
         path.append(cur)
-        cur = list(G.predecessors(cur))[0]
+        cur = int(parent[cur])
+    return path
+
+def get_path(G: nx.DiGraph, leaf: int) -> tuple[int, ...]:
+    # Memoized path_leaf_to_victim, stored on the graph itself
+    # G is a fixed tree for the whole run, so each leaf is only walked once
+    cache = G.graph.setdefault("path_cache", {})
+    path = cache.get(leaf)
+    if path is None:
+        path = cache[leaf] = tuple(path_leaf_to_victim(G, leaf))
     return path
\ No newline at end of file